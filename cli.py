@@ -0,0 +1,92 @@
+"""
+Debloat every Python file under a directory with the local DeepSeek-Coder model.
+
+Files are spread over a pool of worker processes. Each worker loads the model once and
+gets an equal share of the CPU threads, so the workers don't oversubscribe the cores.
+Workers share no model memory (see debloater.MAX_PARALLEL), so each one costs a full model.
+
+Usage:
+    python cli.py <directory> [--workers K]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import debloater
+
+SKIP_DIRS = {'__pycache__', 'venv', 'env', 'node_modules'}
+
+def find_python_files(directory: str) -> list:
+    """All non-empty .py files under directory, skipping hidden directories and virtualenvs"""
+    return sorted(
+        str(path) for path in Path(directory).rglob('*.py')
+        if path.stat().st_size > 0
+        and not any(part in SKIP_DIRS or part.startswith('.')
+                    for part in path.relative_to(directory).parts[:-1])
+    )
+
+def init_worker(threads: int, model_dir: str):
+    """Load the model once for all of this worker's files, with its share of the CPU threads.
+    If loading fails the pool is marked broken, which main() reports instead of hanging."""
+    os.environ['GGML_CACHE'] = model_dir
+    debloater.warmup(threads)
+
+def debloat(file_path: str, threads: int) -> tuple:
+    """Process one file, returning the error message instead of raising so the pool keeps going"""
+    try:
+        return file_path, debloater.process_file(file_path, threads), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+def main():
+    parser = argparse.ArgumentParser(description='Code Debloater for whole directories')
+    parser.add_argument('directory', help='Directory to search for .py files')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes; each needs ~4 GB RAM for its own model')
+    parser.add_argument('--model-dir', default=os.environ.get('GGML_CACHE', debloater.DEFAULT_MODEL_DIR),
+                        help='Directory holding the GGUF model (defaults to GGML_CACHE)')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        print("--workers must be at least 1")
+        sys.exit(1)
+
+    file_paths = find_python_files(args.directory)
+    if not file_paths:
+        print(f"No .py files found under: {args.directory}")
+        sys.exit(1)
+
+    print(f"\n🔧 Debloating {len(file_paths)} files with {args.workers} workers...")
+    start_time = time.time()
+
+    failed = []
+    threads = max(1, debloater.N_THREADS // args.workers)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(threads, args.model_dir)) as pool:
+        futures = [pool.submit(debloat, file_path, threads) for file_path in file_paths]
+        try:
+            for future in as_completed(futures):
+                file_path, metrics, error = future.result()
+                if error:
+                    print(f"\n❌ Error in {file_path}: {error}")
+                    failed.append(file_path)
+                    continue
+                print(f"\n✓ {file_path}: {metrics['original_loc']} → {metrics['new_loc']} LOC "
+                      f"({metrics['reduction']:.2f}% reduction)")
+        except BrokenProcessPool:
+            print("\n❌ Error: a worker failed to load the model or died; see the traceback above")
+            sys.exit(1)
+
+    elapsed_time = time.time() - start_time
+    print(f"\n⏱️  Processed {len(file_paths)} files in {elapsed_time:.2f} seconds")
+    if failed:
+        print(f"❌ {len(failed)} files failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,113 +1,260 @@
-from llama_cpp import Llama
+from llama_cpp import Llama, llama_supports_gpu_offload
 import argparse
+import diskcache
+import functools
+import hashlib
+import importlib.util
+import mmap
 import os
+import re
+import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from queue import Queue
 import time
 
 # Configuration
 MAX_CONTEXT = 16384
-CHUNK_SIZE = 4096
+CHUNK_TOKENS = 3500  # Prompt + CHUNK_TOKENS + 500 new tokens must fit in MAX_CONTEXT // MAX_PARALLEL
+MAX_NEW_TOKENS = CHUNK_TOKENS + 500
+MAX_BYTES_PER_TOKEN = 4  # Generous for code, so each tokenized window usually holds a full chunk
+CONTEXT_TOKENS = 128  # Tail of the previous chunk shown to the model as read-only context
 TEMPERATURE = 0.1
+N_THREADS = min(16, os.cpu_count() or 4)
+N_BATCH = 2048
+N_UBATCH = 512
+# Model contexts decoding chunks concurrently, splitting MAX_CONTEXT and N_THREADS between them.
+# llama.cpp repacks Q4_0 into a private buffer per context (~0.75 GB each), and each context
+# reads all of it for every token, so extra contexts add memory without sharing bandwidth.
+# Raise this only after measuring a speedup on the target machine.
+MAX_PARALLEL = 1
+MODEL_FILE = "deepseek-coder-1.3b-instruct.Q4_0.gguf"  # repacked to interleaved SIMD layout at load
+CACHE_DIR = ".debloat_cache"
+DEFAULT_MODEL_DIR = os.path.join('D:\\', 'huggingface_cache')  # Used unless GGML_CACHE is set
 
-os.environ['GGML_CACHE'] = os.path.join('D:\\', 'huggingface_cache')
+SYSTEM_PROMPT = """Refactor code to remove bloat while maintaining functionality.
+Return ONLY the cleaned code wrapped in ``` delimiters, no analysis.
+Code under "Preceding context:" has already been handled; use it only to understand the original code and never include it in your output."""
+
+PROMPT_TEMPLATE = """{context}Original code:
+{code}
+
+Cleaned code:"""
+
+CONTEXT_TEMPLATE = """Preceding context:
+{context}
 
-def count_loc(code: str) -> int:
+"""
+
+# UTF-8 encodings of every character str.isspace() accepts except '\n' (bytes \s is ASCII-only)
+_WS = (rb'(?:[\t\x0b\x0c\r\x1c-\x1f ]|\xc2[\x85\xa0]|\xe1\x9a\x80'
+       rb'|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)')
+# Start of a line that isn't blank and whose first non-whitespace character doesn't open a comment
+_LOC_RE = re.compile(rb'^' + _WS + rb'*(?!' + _WS + rb'|$|#|//)', re.M)
+
+# Body of the first fenced block, after an optional language tag
+_CODE_RE = re.compile(r'```[\w+-]*[^\S\n]*\n(.*?)```', re.DOTALL)
+
+def count_loc(code: bytes) -> int:
     """Count lines of code ignoring comments and blanks"""
-    return sum(1 for line in code.split('\n') 
-              if line.strip() and not line.strip().startswith(('#', '//')))
+    return sum(1 for _ in _LOC_RE.finditer(code))
 
-def load_model():
+def load_model(n_ctx: int = MAX_CONTEXT, n_threads: int = N_THREADS):
     print("\n📚 Loading the model...")
-    model_file = "deepseek-coder-1.3b-instruct.Q4_K_M.gguf"
-    model_path = os.path.join(os.environ['GGML_CACHE'], model_file)
+    model_dir = os.environ.setdefault('GGML_CACHE', DEFAULT_MODEL_DIR)
+    model_path = os.path.join(model_dir, MODEL_FILE)
     
     if not os.path.exists(model_path):
         print("⬇️  Downloading model from HuggingFace...")
+        # Parallel range downloads in Rust; must be set before huggingface_hub is imported
+        if importlib.util.find_spec('hf_transfer'):
+            os.environ.setdefault('HF_HUB_ENABLE_HF_TRANSFER', '1')
         from huggingface_hub import hf_hub_download
         hf_hub_download(
             repo_id="TheBloke/deepseek-coder-1.3b-instruct-GGUF",
-            filename=model_file,
-            local_dir=os.environ['GGML_CACHE'],
-            resume_download=True
+            filename=MODEL_FILE,
+            local_dir=model_dir
         )
     else:
         print("✓ Using cached model")
 
     print("🚀 Initializing model...")
+    gpu_offload = llama_supports_gpu_offload()
     return Llama(
         model_path=model_path,
-        n_ctx=MAX_CONTEXT,
-        n_threads=4,
-        n_gpu_layers=0,
+        n_ctx=n_ctx,
+        n_threads=n_threads,
+        n_threads_batch=n_threads,
+        n_batch=N_BATCH,
+        n_ubatch=N_UBATCH,
+        n_gpu_layers=-1 if gpu_offload else 0,  # all layers when built with CUDA/Metal
         verbose=False
     )
 
-def process_chunk(llm: Llama, original: str) -> str:
-    print("📝 Processing code chunk...")
-    response = llm.create_chat_completion(
-        messages=[{
-            "role": "user",
-            "content": f"""Refactor this code to remove bloat while maintaining functionality.
-Return ONLY the cleaned code wrapped in ``` delimiters, no analysis.
+@functools.lru_cache(maxsize=1)
+def load_models(n: int = MAX_PARALLEL, threads: int = N_THREADS) -> Queue:
+    """Load n model contexts, one per concurrent chunk (see MAX_PARALLEL), sharing threads between them.
+    Cached, so repeated process_file calls with the same threads reuse the loaded contexts."""
+    models = Queue()
+    for _ in range(n):
+        models.put(load_model(n_ctx=MAX_CONTEXT // n, n_threads=max(1, threads // n)))
+    return models
 
-Original code:
-{original}
+def build_messages(code: str, context: str = "") -> list:
+    """Chat messages for a chunk. The system prompt comes first and never changes, so every
+    chunk's prompt shares a prefix that llama.cpp keeps in the KV cache between calls."""
+    return [{
+        "role": "system",
+        "content": SYSTEM_PROMPT
+    }, {
+        "role": "user",
+        "content": PROMPT_TEMPLATE.format(
+            context=CONTEXT_TEMPLATE.format(context=context) if context else "",
+            code=code
+        )
+    }]
 
-Cleaned code:"""
-        }],
-        max_tokens=CHUNK_SIZE + 500,
+def warmup(threads: int = N_THREADS):
+    """Prefill the shared prompt prefix on every context, paging in the weights as well.
+    Later chunks only evaluate the tokens after the longest prefix already in the KV cache."""
+    for llm in list(load_models(threads=threads).queue):
+        llm.create_chat_completion(messages=build_messages(""), max_tokens=1)
+
+@functools.lru_cache(maxsize=1)
+def get_cache() -> diskcache.Cache:
+    """Open the on-disk response cache shared across runs"""
+    return diskcache.Cache(CACHE_DIR)
+
+def split_chunks(llm: Llama, buf: bytes, chunk_tokens: int = CHUNK_TOKENS) -> list:
+    """Split UTF-8 code into non-overlapping chunks of up to chunk_tokens model tokens on line boundaries.
+    Only one window at a time is copied out and tokenized, so buf can be an mmap of the whole file."""
+    chunks, start = [], 0
+    while start < len(buf):
+        end = min(start + chunk_tokens * MAX_BYTES_PER_TOKEN, len(buf))
+        tokens = llm.tokenize(buf[start:end], add_bos=False)
+        if len(tokens) > chunk_tokens:
+            end = start + len(llm.detokenize(tokens[:chunk_tokens]))
+        if end < len(buf):
+            newline = buf.rfind(b'\n', start, end)
+            # A single line longer than the token budget becomes its own chunk
+            end = newline + 1 if newline != -1 else (buf.find(b'\n', end) + 1 or len(buf))
+        chunks.append(buf[start:end].decode('utf-8').replace('\r\n', '\n'))
+        start = end
+    return chunks
+
+def tail_tokens(llm: Llama, code: str, n: int = CONTEXT_TOKENS) -> str:
+    """Return the last n tokens of code, cut on the model's token boundaries"""
+    tokens = llm.tokenize(code.encode('utf-8'), add_bos=False)
+    return llm.detokenize(tokens[-n:]).decode('utf-8', errors='ignore')
+
+def extract_code(response_content: str) -> str:
+    """Extract code from the model's response, or return it as-is if it isn't fenced"""
+    match = _CODE_RE.search(response_content)
+    if match:
+        # Keep the first line's indentation; chunks can start inside a block
+        return match.group(1).lstrip('\n').rstrip()
+    return response_content
+
+def cache_key(original: str, context: str) -> str:
+    """Hash every input that affects a chunk's generation. Hashing the repr of a tuple keeps the
+    field boundaries unambiguous, so context and code can't run into each other."""
+    fields = (MODEL_FILE, SYSTEM_PROMPT, PROMPT_TEMPLATE, CONTEXT_TEMPLATE,
+              TEMPERATURE, MAX_NEW_TOKENS, context, original)
+    return hashlib.blake2b(repr(fields).encode()).hexdigest()
+
+def process_chunk(llm: Llama, original: str, context: str = "") -> str:
+    cache = get_cache()
+    key = cache_key(original, context)
+    cached = cache.get(key)
+    if cached is not None:
+        print("✓ Chunk served from cache")
+        return cached
+    
+    print("📝 Processing code chunk...")
+    response = llm.create_chat_completion(
+        messages=build_messages(original, context),
+        max_tokens=MAX_NEW_TOKENS,
         temperature=TEMPERATURE
     )
     print("✓ Chunk processed")
     
-    result = response['choices'][0]['message']['content']
-    if '```' in result:
-        return result.split('```')[1].strip().lstrip('python\n')
+    result = extract_code(response['choices'][0]['message']['content'])
+    cache[key] = result
     return result
 
-def process_file(file_path: str) -> dict:
+def process_chunks(models: Queue, chunks: list, contexts: list):
+    """Process chunks concurrently, each on whichever model context is free.
+    Yields results in chunk order as soon as each one is ready."""
+    def run(numbered):
+        chunk_num, (chunk, context) = numbered
+        llm = models.get()
+        try:
+            print(f"\n⚙️  Processing chunk {chunk_num}/{len(chunks)}")
+            return process_chunk(llm, chunk, context)
+        finally:
+            models.put(llm)
+
+    # llama.cpp releases the GIL while decoding, so the contexts run in parallel
+    with ThreadPoolExecutor(max_workers=models.qsize()) as pool:
+        yield from pool.map(run, enumerate(zip(chunks, contexts), 1))
+
+def write_backup(backup_path: str, data: bytes):
+    """Write a byte-for-byte copy of the original file"""
+    with open(backup_path, 'wb') as backup:
+        backup.write(data)
+
+def process_file(file_path: str, threads: int = N_THREADS) -> dict:
+    # Rewrite a symlink's target rather than replacing the link with a regular file
+    file_path = os.path.realpath(file_path)
     print(f"\n📂 Opening file: {file_path}")
-    with open(file_path, 'r+', encoding='utf-8') as f:
-        original_code = f.read()
-        original_loc = count_loc(original_code)
-        print(f"📊 Original LOC: {original_loc}")
+    if os.path.getsize(file_path) == 0:
+        raise ValueError(f"Nothing to debloat, file is empty: {file_path}")
+    
+    backup_path = f"{file_path}.bak"
+    tmp_path = f"{file_path}.tmp"
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf, \
+            ThreadPoolExecutor(max_workers=1) as io_pool, \
+            open(tmp_path, 'w', encoding='utf-8') as tmp:
+        # Create backup in the background while the model works
+        print(f"📑 Creating backup at: {backup_path}")
+        backup = io_pool.submit(write_backup, backup_path, buf)
         
-        llm = load_model()
-        processed_chunks = []
+        original_loc = count_loc(buf)
+        print(f"📊 Original LOC: {original_loc}")
         
-        total_chunks = len(original_code) // (CHUNK_SIZE//2) + 1
-        print(f"\n🔄 Processing {total_chunks} chunks...")
+        models = load_models(threads=threads)
+        tokenizer = models.queue[0]
         
-        # Process in overlapping chunks
-        for i in range(0, len(original_code), CHUNK_SIZE//2):
-            chunk_num = (i // (CHUNK_SIZE//2)) + 1
-            print(f"\n⚙️  Processing chunk {chunk_num}/{total_chunks}")
-            chunk = original_code[i:i+CHUNK_SIZE]
-            processed = process_chunk(llm, chunk)
-            processed_chunks.append(processed)
-            
-        print("\n💾 Saving results...")
-        new_code = '\n'.join(processed_chunks)
-        new_loc = count_loc(new_code)
+        # Each chunk is sent once; the previous chunk's tail only serves as context
+        chunks = split_chunks(tokenizer, buf)
+        print(f"\n🔄 Processing {len(chunks)} chunks...")
         
-        # Create backup
-        backup_path = f"{file_path}.bak"
-        print(f"📑 Creating backup at: {backup_path}")
-        with open(backup_path, 'w', encoding='utf-8') as backup:
-            backup.write(original_code)
+        contexts = [""] + [tail_tokens(tokenizer, chunk) for chunk in chunks[:-1]]
         
-        # Write debloated code
-        print("✍️  Writing debloated code...")
-        f.seek(0)
-        f.write(new_code)
-        f.truncate()
+        # Write debloated code next to the original as chunks finish, then swap it in atomically
+        print(f"✍️  Writing debloated code to: {tmp_path}")
+        new_loc = 0
+        for chunk_num, processed in enumerate(process_chunks(models, chunks, contexts)):
+            if chunk_num:
+                tmp.write('\n')
+            tmp.write(processed)
+            tmp.flush()
+            new_loc += count_loc(processed.encode('utf-8'))
         
-        return {
-            'original_loc': original_loc,
-            'new_loc': new_loc,
-            'reduction': ((original_loc - new_loc)/original_loc)*100
-        }
+        print("\n💾 Saving results...")
+        backup.result()
+    
+    shutil.copymode(file_path, tmp_path)  # Keep permissions such as +x on the rewritten file
+    os.replace(tmp_path, file_path)
+    
+    return {
+        'original_loc': original_loc,
+        'new_loc': new_loc,
+        'reduction': ((original_loc - new_loc)/original_loc)*100,
+        'backup_path': backup_path
+    }
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Code Debloater')
@@ -118,6 +265,7 @@ if __name__ == "__main__":
     start_time = time.time()
 
     try:
+        warmup()
         print("\n🔍 Analyzing and refactoring code...")
         
         metrics = process_file(args.file_path)
@@ -129,7 +277,7 @@ if __name__ == "__main__":
         print(f"Original LOC: {metrics['original_loc']}")
         print(f"New LOC:      {metrics['new_loc']}")
         print(f"Reduction:    {metrics['reduction']:.2f}%")
-        print(f"Backup saved: {args.file_path}.bak")
+        print(f"Backup saved: {metrics['backup_path']}")
         print("====================")
         
     except Exception as e:
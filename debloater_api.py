@@ -3,7 +3,7 @@ This script takes a Python file as input, sends its content to a specified LLM A
 with a customizable prompt to debloat the code, and writes the response back to the original file.
 
 Usage:
-    python debloat_script.py <path_to_python_file>
+    python debloat_script.py <path_to_python_file> [<path_to_python_file> ...]
 
 Requirements:
     - Python 3.x
@@ -15,22 +15,27 @@ Note:
 """
 
 import openai
+import ast
+import asyncio
+import diskcache
+import functools
+import hashlib
+import orjson
 import os
 import sys
 import re
-import requests
+import shutil
+import textwrap
+import httpx
 import argparse
 from dotenv import load_dotenv
 
-def count_loc(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-            return len(lines)
-    except FileNotFoundError:
-        print(f"File not found: {file_path}")
-    except Exception as e:
-        print(f"Error reading file: {e}")
+# Body of the first fenced block, after an optional language tag
+_CODE_RE = re.compile(r'```[\w+-]*[^\S\n]*\n(.*?)```', re.DOTALL)
+
+def count_loc(code: str) -> int:
+    """Count lines the way readlines() would, without re-reading the file"""
+    return code.count('\n') + (bool(code) and not code.endswith('\n'))
 
 # LLM Provider configurations
 LLM_PROVIDERS = [
@@ -40,8 +45,18 @@ LLM_PROVIDERS = [
 
 class LLMConfig:
     OPENAI_MODEL = "gpt-4"
+    OPENAI_CANDIDATES = 1  # Completions sampled per request; the shortest one that parses wins
+    OPENAI_SYSTEM_PROMPT = "You are a code optimization assistant."
+    OPENAI_PROMPT = "Debloat this code while maintaining functionality:\n\n{code}"
+    DEEPSEEK_MODEL = "deepseek-coder"
+    DEEPSEEK_PROMPT = "Refactor this code to remove bloat while maintaining functionality:\n{code}"
     DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
     TEMPERATURE = 0.2
+    REQUEST_TIMEOUT = 120
+    CHUNK_SIZE = 4096
+    MAX_CONCURRENT_REQUESTS = 8
+    MAX_KEEPALIVE_CONNECTIONS = 16
+    CACHE_DIR = ".debloat_cache"
 
 def setup_environment():
     """Setup environment variables and API keys"""
@@ -57,66 +72,173 @@ def setup_environment():
     
     return api_keys
 
-def process_with_openai(code: str, api_key: str) -> str:
-    """Process code using OpenAI API"""
-    client = openai.OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
+def create_client(llm_provider: str, api_keys: dict):
+    """Create the provider's async client. Use it with `async with` inside one event loop run,
+    so every request reuses its connection pool and the pool is closed with that loop."""
+    if llm_provider == "openai":
+        return openai.AsyncOpenAI(api_key=api_keys["openai"])
+    elif llm_provider == "deepseek":
+        # HTTP/2 keep-alive: DeepSeek calls share one TLS connection instead of a handshake each
+        return httpx.AsyncClient(
+            http2=True,
+            timeout=LLMConfig.REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=LLMConfig.MAX_KEEPALIVE_CONNECTIONS),
+            headers={
+                "Authorization": f"Bearer {api_keys['deepseek']}",
+                "Content-Type": "application/json"
+            }
+        )
+    raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+
+@functools.lru_cache(maxsize=1)
+def get_cache() -> diskcache.Cache:
+    """Open the on-disk response cache shared across runs"""
+    return diskcache.Cache(LLMConfig.CACHE_DIR)
+
+def cache_key(code: str, llm_provider: str, candidates: int = LLMConfig.OPENAI_CANDIDATES) -> str:
+    """Hash every input that affects a chunk's response, the same way as debloater.cache_key"""
+    if llm_provider == "openai":
+        request = (LLMConfig.OPENAI_MODEL, candidates,
+                   LLMConfig.OPENAI_SYSTEM_PROMPT, LLMConfig.OPENAI_PROMPT)
+    elif llm_provider == "deepseek":
+        request = (LLMConfig.DEEPSEEK_MODEL, LLMConfig.DEEPSEEK_PROMPT)
+    else:
+        raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+    fields = (llm_provider, *request, LLMConfig.TEMPERATURE, code)
+    return hashlib.blake2b(repr(fields).encode()).hexdigest()
+
+def split_chunks(code: str, chunk_size: int = LLMConfig.CHUNK_SIZE) -> list:
+    """Split code into non-overlapping chunks of up to chunk_size characters on line boundaries"""
+    chunks, current, size = [], [], 0
+    for line in code.splitlines(keepends=True):
+        if current and size + len(line) > chunk_size:
+            chunks.append(''.join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+def parses(code: str) -> bool:
+    """Whether code is valid Python on its own, ignoring indentation shared by every line"""
+    try:
+        ast.parse(textwrap.dedent(code))
+    except (SyntaxError, ValueError):
+        return False
+    return True
+
+def select_candidate(contents: list) -> str:
+    """Pick the response with the shortest code that still parses, falling back to the first"""
+    parsed = []
+    for content in contents:
+        try:
+            code = extract_code(content)
+        except ValueError:
+            continue
+        if parses(code):
+            parsed.append((len(code), content))
+    return min(parsed, key=lambda c: c[0])[1] if parsed else contents[0]
+
+async def process_with_openai(code: str, client: openai.AsyncOpenAI,
+                              candidates: int = LLMConfig.OPENAI_CANDIDATES) -> str:
+    """Process code using OpenAI API, sampling up to candidates completions"""
+    # Candidates can only be compared by parsing them, which needs a chunk that parses to begin with
+    if not parses(code):
+        candidates = 1
+    response = await client.chat.completions.create(
         model=LLMConfig.OPENAI_MODEL,
         messages=[
-            {"role": "system", "content": "You are a code optimization assistant."},
-            {"role": "user", "content": f"Debloat this code while maintaining functionality:\n\n{code}"}
+            {"role": "system", "content": LLMConfig.OPENAI_SYSTEM_PROMPT},
+            {"role": "user", "content": LLMConfig.OPENAI_PROMPT.format(code=code)}
         ],
-        temperature=LLMConfig.TEMPERATURE
+        temperature=LLMConfig.TEMPERATURE,
+        n=candidates
     )
-    return response.choices[0].message.content
+    return select_candidate([choice.message.content for choice in response.choices])
 
-def process_with_deepseek(code: str, api_key: str) -> str:
+async def process_with_deepseek(code: str, client: httpx.AsyncClient) -> str:
     """Process code using DeepSeek API"""
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
-        "model": "deepseek-coder",
+        "model": LLMConfig.DEEPSEEK_MODEL,
         "messages": [{
             "role": "user",
-            "content": f"Refactor this code to remove bloat while maintaining functionality:\n{code}"
+            "content": LLMConfig.DEEPSEEK_PROMPT.format(code=code)
         }],
         "temperature": LLMConfig.TEMPERATURE
     }
     
-    response = requests.post(LLMConfig.DEEPSEEK_API_URL, headers=headers, json=payload)
+    response = await client.post(LLMConfig.DEEPSEEK_API_URL, content=orjson.dumps(payload))
     response.raise_for_status()
-    return response.json()['choices'][0]['message']['content']
+    return orjson.loads(response.content)['choices'][0]['message']['content']
+
+async def process_chunk(chunk: str, llm_provider: str, client, semaphore: asyncio.Semaphore,
+                        candidates: int = LLMConfig.OPENAI_CANDIDATES) -> str:
+    """Debloat a single chunk, holding the semaphore for the duration of the request"""
+    cache = get_cache()
+    key = cache_key(chunk, llm_provider, candidates)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    
+    async with semaphore:
+        if llm_provider == "openai":
+            response = await process_with_openai(chunk, client, candidates)
+        elif llm_provider == "deepseek":
+            response = await process_with_deepseek(chunk, client)
+        else:
+            raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+    debloated = extract_code(response)
+    cache[key] = debloated
+    return debloated
 
-def process_file(file_path: str, llm_provider: str, api_keys: dict) -> dict:
+def write_backup(backup_path: str, code: str):
+    """Write the original code to its backup file"""
+    with open(backup_path, 'w', encoding='utf-8') as f:
+        f.write(code)
+
+async def process_file(file_path: str, llm_provider: str, client, semaphore: asyncio.Semaphore,
+                       candidates: int = LLMConfig.OPENAI_CANDIDATES) -> dict:
     """Process a file using specified LLM provider"""
-    print(f"\n🔧 Processing with {llm_provider.upper()}...")
+    # Rewrite a symlink's target rather than replacing the link with a regular file
+    file_path = os.path.realpath(file_path)
+    print(f"\n🔧 Processing {file_path} with {llm_provider.upper()}...")
     
     with open(file_path, 'r', encoding='utf-8') as f:
         code = f.read()
-        original_loc = count_loc(file_path)
+    original_loc = count_loc(code)
     
     try:
-        if llm_provider == "openai":
-            response = process_with_openai(code, api_keys["openai"])
-        elif llm_provider == "deepseek":
-            response = process_with_deepseek(code, api_keys["deepseek"])
-        else:
-            raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+        # Create backup in a worker thread while the requests are in flight
+        backup_path = f"{file_path}.bak"
+        backup = asyncio.get_running_loop().run_in_executor(None, write_backup, backup_path, code)
         
-        debloated_code = extract_code(response)
+        chunks = split_chunks(code)
+        tasks = [asyncio.ensure_future(process_chunk(chunk, llm_provider, client, semaphore, candidates))
+                 for chunk in chunks]
+        
+        # Write results next to the original in chunk order as they arrive
+        tmp_path = f"{file_path}.tmp"
+        new_loc = 0
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for chunk_num, task in enumerate(tasks):
+                    debloated = await task
+                    if chunk_num:
+                        f.write('\n')
+                    f.write(debloated)
+                    f.flush()
+                    new_loc += count_loc(debloated)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        
+        # Swap the results in once the backup is safely on disk
+        await backup
+        shutil.copymode(file_path, tmp_path)  # As in debloater.process_file
+        os.replace(tmp_path, file_path)
         
-        # Create backup and save results
-        backup_path = f"{file_path}.bak"
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            f.write(code)
-            
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(debloated_code)
-            
-        new_loc = count_loc(file_path)
         return {
             'original_loc': original_loc,
             'new_loc': new_loc,
@@ -129,37 +251,62 @@ def process_file(file_path: str, llm_provider: str, api_keys: dict) -> dict:
 
 def extract_code(response_content):
     """Extract code from LLM response"""
-    match = re.search(r'```python(.*?)```', response_content, re.DOTALL)
+    match = _CODE_RE.search(response_content)
     if match:
-        return match.group(1).strip()
+        # Indentation kept as in debloater.extract_code
+        return match.group(1).lstrip('\n').rstrip()
     else:
         raise ValueError("Error: Could not extract code from LLM response")
 
+async def process_files(file_paths: list, llm_provider: str, api_keys: dict,
+                        candidates: int = LLMConfig.OPENAI_CANDIDATES) -> list:
+    """Process files concurrently, capping in-flight LLM requests across all of them"""
+    semaphore = asyncio.Semaphore(LLMConfig.MAX_CONCURRENT_REQUESTS)
+    async with create_client(llm_provider, api_keys) as client:
+        return await asyncio.gather(
+            *[process_file(path, llm_provider, client, semaphore, candidates) for path in file_paths],
+            return_exceptions=True
+        )
+
 def main():
     parser = argparse.ArgumentParser(description='Code Debloater')
-    parser.add_argument('file_path', help='Path to code file')
+    parser.add_argument('file_paths', nargs='+', help='Path(s) to code file')
     parser.add_argument('--llm', type=int, default=0,
                       help=f'LLM provider index {list(enumerate(LLM_PROVIDERS))}')
+    parser.add_argument('--candidates', type=int, default=LLMConfig.OPENAI_CANDIDATES,
+                      help='OpenAI only: completions to sample per chunk, keeping the shortest that parses')
     args = parser.parse_args()
     
     if not (0 <= args.llm < len(LLM_PROVIDERS)):
         print(f"Invalid LLM index. Choose from: {list(enumerate(LLM_PROVIDERS))}")
         sys.exit(1)
+    if args.candidates < 1:
+        print("--candidates must be at least 1")
+        sys.exit(1)
         
     try:
         api_keys = setup_environment()
         llm_provider = LLM_PROVIDERS[args.llm]
-        metrics = process_file(args.file_path, llm_provider, api_keys)
+        results = asyncio.run(process_files(args.file_paths, llm_provider, api_keys, args.candidates))
+    except Exception as e:
+        print(f"\n❌ Error: {str(e)}")
+        sys.exit(1)
+    
+    failed = False
+    for file_path, metrics in zip(args.file_paths, results):
+        if isinstance(metrics, Exception):
+            print(f"\n❌ Error in {file_path}: {str(metrics)}")
+            failed = True
+            continue
         
-        print(f"\n=== Code Metrics ===")
+        print(f"\n=== Code Metrics: {file_path} ===")
         print(f"Original LOC: {metrics['original_loc']}")
         print(f"New LOC:      {metrics['new_loc']}")
         print(f"Reduction:    {metrics['reduction']:.2f}%")
         print(f"Backup saved: {metrics['backup_path']}")
         print("====================")
-        
-    except Exception as e:
-        print(f"\n❌ Error: {str(e)}")
+    
+    if failed:
         sys.exit(1)
 
 if __name__ == "__main__":